@@ -1,19 +1,44 @@
-from flask import Flask, request, render_template_string, send_file, jsonify
+from flask import Flask, request, render_template_string, send_file, send_from_directory, jsonify
 from werkzeug.utils import secure_filename
 import os
 import fitz  # PyMuPDF
+import hashlib
 import json
-import base64
 from pathlib import Path
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+from operator import itemgetter
+from types import MappingProxyType
 from deep_translator import GoogleTranslator, MyMemoryTranslator
 import re
+import sqlite3
+import time
 import zipfile
 from io import BytesIO
 import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 
+# orjson (Rust) сериализует JSON в разы быстрее stdlib — выигрыш на часто
+# опрашиваемых endpoint'ах статуса. Зависимость необязательная: без неё
+# Flask остаётся на стандартном json
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+
+    class _OrjsonProvider(JSONProvider):
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode('utf-8')
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = _OrjsonProvider(app)
+except ImportError:
+    pass
+
 # Конфигурация
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB максимум
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -24,44 +49,257 @@ app.config['ALLOWED_EXTENSIONS'] = {'pdf'}
 Path(app.config['UPLOAD_FOLDER']).mkdir(exist_ok=True)
 Path(app.config['OUTPUT_FOLDER']).mkdir(exist_ok=True)
 
-# Хранилище задач
+# Хранилище задач; блокировка защищает многополевые обновления от
+# частичного чтения в endpoint'ах статуса
 tasks = {}
+_tasks_lock = threading.Lock()
+
+# Общий пул обработки задач: ограничивает число одновременных переводов,
+# чтобы не плодить поток (и полный PDFTranslator в памяти) на каждый запрос
+_task_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='pdf-task')
+
+# Поддерживаемые языки: название (в нижнем регистре) -> код.
+# MappingProxyType защищает словари от случайной мутации из рабочих потоков
+LANGUAGE_CODES = MappingProxyType({
+    'english': 'en',
+    'russian': 'ru',
+    'german': 'de',
+    'french': 'fr',
+    'spanish': 'es',
+    'italian': 'it',
+    'chinese': 'zh-CN',
+    'japanese': 'ja',
+})
+LANGUAGE_NAMES = MappingProxyType({code: name for name, code in LANGUAGE_CODES.items()})
+_CODE_SET = frozenset(LANGUAGE_CODES.values())
+# Всё, что принимаем в параметрах source_lang/target_lang
+VALID_LANG_TOKENS = frozenset(LANGUAGE_CODES) | _CODE_SET
+
+
+@lru_cache(maxsize=256)
+def get_language_code(language):
+    """Приводит название или код языка к коду ('english' -> 'en')"""
+    code = LANGUAGE_CODES.get(language.lower())
+    if code is not None:
+        return code
+    return language
+
+
+@lru_cache(maxsize=256)
+def get_language_name(code):
+    """Возвращает название языка по коду ('en' -> 'english')"""
+    return LANGUAGE_NAMES.get(code, code)
+
+# Кэш клиентов перевода: клиенты deep-translator не хранят состояние между
+# вызовами, поэтому один экземпляр на пару языков можно переиспользовать
+# во всех задачах вместо создания заново на каждый PDF
+_translator_cache = {}
+_translator_cache_lock = threading.Lock()
+
+
+def _get_translator(source_lang, target_lang):
+    key = (source_lang, target_lang)
+    with _translator_cache_lock:
+        cached = _translator_cache.get(key)
+        if cached is not None:
+            return cached
 
-class PDFTranslator:
-    def __init__(self, terminology_dict=None, source_lang='en', target_lang='ru'):
-        self.terminology = terminology_dict or {}
-        self.source_lang = source_lang
-        self.target_lang = target_lang
-        
         # Используем MyMemoryTranslator как основной, с fallback на Google
         try:
-            self.translator = MyMemoryTranslator(source=source_lang, target=target_lang)
-            self.translator_type = 'MyMemory'
+            translator = MyMemoryTranslator(source=source_lang, target=target_lang)
+            translator_type = 'MyMemory'
         except:
-            self.translator = GoogleTranslator(source=source_lang, target=target_lang)
-            self.translator_type = 'Google'
-        
+            translator = GoogleTranslator(source=source_lang, target=target_lang)
+            translator_type = 'Google'
+
+        _translator_cache[key] = (translator, translator_type)
+        return translator, translator_type
+
+
+# Разделитель блоков при пакетном переводе: собственная строка из «нейтральных»
+# символов, которые переводчики оставляют как есть. Регэкс разбора терпим
+# к типичным искажениям — вставленным пробелам между символами
+_BATCH_SEPARATOR = "\n@@@\n"
+_BATCH_SEPARATOR_RE = re.compile(r'\s*@\s*@\s*@\s*')
+
+# Хоть одна буква в любом алфавите ([^\W\d_] = \w минус цифры и подчёркивание);
+# номера страниц, формулы и прочие безбуквенные блоки переводить нечего
+_HAS_LETTER_RE = re.compile(r'[^\W\d_]')
+
+# Экранирование HTML и перенос строк за один C-проход по тексту блока;
+# заодно чинит разметку для текстов, содержащих <, > или &
+_HTML_ESCAPE_TABLE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '\n': '<br>',
+})
+
+# Шаблоны блоков результата, собранные один раз на модуль: в горячем цикле
+# генерации остаётся только %-подстановка
+_TEXT_BLOCK_TPL = """
+        <div class="translation-toggle">
+            <button class="toggle-btn" id="btn-%d" onclick="toggleOriginal(%d)">Показать оригинал</button>
+            <div class="text-block">
+                %s
+            </div>
+            <div class="original-text" id="original-%d">
+                <strong>Оригинал:</strong><br>
+                %s
+            </div>
+        </div>
+"""
+
+_IMAGE_BLOCK_TPL = """
+        <div class="image-container">
+            <img src="images/%s"
+                 alt="Изображение со страницы %d">
+            <div class="image-caption">Рисунок %d (Страница %d)</div>
+        </div>
+"""
+
+# Кэш переводов: технические PDF повторяют колонтитулы, подписи и короткие
+# фразы десятки раз — каждая уникальная строка уходит в сеть один раз.
+# Кэш общий для всех задач; OrderedDict работает как LRU с жёстким потолком,
+# чтобы долгоживущий процесс не рос бесконечно
+_TRANSLATION_CACHE_MAX = 10000
+_translation_cache = OrderedDict()
+_translation_cache_lock = threading.Lock()
+
+
+def _l1_store(cache_key, translation):
+    """Кладёт перевод в память с LRU-вытеснением"""
+    with _translation_cache_lock:
+        _translation_cache[cache_key] = translation
+        _translation_cache.move_to_end(cache_key)
+        while len(_translation_cache) > _TRANSLATION_CACHE_MAX:
+            _translation_cache.popitem(last=False)
+
+
+# Второй ярус кэша — SQLite-файл рядом с uploads/outputs: переводы переживают
+# рестарт процесса и деплой, тёплый перезапуск не платит за сеть повторно
+try:
+    _cache_db = sqlite3.connect('translation_cache.db', check_same_thread=False)
+    _cache_db.execute('PRAGMA journal_mode=WAL')
+    _cache_db.execute(
+        'CREATE TABLE IF NOT EXISTS translations ('
+        'key BLOB PRIMARY KEY, translation TEXT NOT NULL)'
+    )
+    _cache_db.commit()
+except Exception as e:
+    print(f"Кэш переводов на диске недоступен: {e}")
+    _cache_db = None
+_cache_db_lock = threading.Lock()
+
+
+def _cache_db_key(cache_key):
+    # Ключ кортежный (языки, словарь терминов, дайджест текста) —
+    # сворачиваем его в один BLOB фиксированной длины
+    source_lang, target_lang, term_key, digest = cache_key
+    prefix = repr((source_lang, target_lang, term_key)).encode('utf-8')
+    return hashlib.blake2b(prefix + digest, digest_size=16).digest()
+
+
+def _cache_lookup(cache_key):
+    """Пробует оба яруса кэша без похода в сеть; поднимает дисковый хит в L1"""
+    with _translation_cache_lock:
+        cached = _translation_cache.get(cache_key)
+        if cached is not None:
+            _translation_cache.move_to_end(cache_key)
+    if cached is None:
+        cached = _cache_db_get(cache_key)
+        if cached is not None:
+            _l1_store(cache_key, cached)
+    return cached
+
+
+def _cache_db_get(cache_key):
+    if _cache_db is None:
+        return None
+    try:
+        with _cache_db_lock:
+            row = _cache_db.execute(
+                'SELECT translation FROM translations WHERE key = ?',
+                (_cache_db_key(cache_key),)
+            ).fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"Ошибка чтения кэша переводов: {e}")
+        return None
+
+
+def _cache_db_put(cache_key, translation):
+    if _cache_db is None:
+        return
+    try:
+        with _cache_db_lock:
+            _cache_db.execute(
+                'INSERT OR REPLACE INTO translations (key, translation) VALUES (?, ?)',
+                (_cache_db_key(cache_key), translation)
+            )
+            _cache_db.commit()
+    except Exception as e:
+        print(f"Ошибка записи кэша переводов: {e}")
+
+
+class PDFTranslator:
+    def __init__(self, terminology_dict=None, source_lang='en', target_lang='ru',
+                 skip_trivial_blocks=True):
+        self.load_terminology_from_dict(terminology_dict or {})
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+
+        self.translator, self.translator_type = _get_translator(source_lang, target_lang)
         print(f"Используется переводчик: {self.translator_type}")
+        # MyMemory ограничивает запрос ~500 символами, Google — ~5000
+        self._batch_char_limit = 450 if self.translator_type == 'MyMemory' else 4500
         self.images_data = []
         self.content_blocks = []
-        
+        # Кэш разбора страниц: каждая страница парсится PyMuPDF не более одного раза,
+        # повторные вызовы extract_* переиспользуют уже готовые блоки
+        self._text_cache = {}
+        self._image_cache = {}
+        # Один и тот же xref может встречаться на многих страницах —
+        # декодируем и пишем его только один раз
+        self._xref_files = {}
+        # Отсев номеров страниц и мусорных однобуквенных блоков ещё на этапе
+        # извлечения; выключается для тех, кому нужны сырые блоки
+        self.skip_trivial_blocks = skip_trivial_blocks
+
     def load_terminology_from_dict(self, term_dict):
         """Загрузка терминов из словаря"""
         self.terminology = term_dict
-        
+        # Перевод зависит от словаря терминов — он входит в ключ кэша
+        self._term_key = tuple(sorted(term_dict.items())) if term_dict else ()
+
+        # Один скомпилированный regex-альтернатив на весь словарь: единственный
+        # проход по тексту вместо отдельного compile+sub на каждый термин.
+        # Длинные термины идут первыми, чтобы они выигрывали у своих подстрок
+        if term_dict:
+            sorted_terms = sorted(term_dict.keys(), key=len, reverse=True)
+            self._sorted_terms = sorted_terms
+            self._term_regex = re.compile(
+                "|".join(re.escape(term) for term in sorted_terms), re.IGNORECASE
+            )
+            self._term_index = {term.lower(): idx for idx, term in enumerate(sorted_terms)}
+        else:
+            self._sorted_terms = []
+            self._term_regex = None
+            self._term_index = {}
+
     def protect_terminology(self, text):
-        protected_text = text
+        if self._term_regex is None:
+            return text, {}
+
         term_map = {}
-        sorted_terms = sorted(self.terminology.keys(), key=len, reverse=True)
-        
-        for idx, term in enumerate(sorted_terms):
-            if term.lower() in protected_text.lower():
-                placeholder = f"__TERM{idx}__"
-                pattern = re.compile(re.escape(term), re.IGNORECASE)
-                protected_text = pattern.sub(placeholder, protected_text)
-                term_map[placeholder] = self.terminology[term]
-        
-        return protected_text, term_map
+
+        def replace_term(match):
+            idx = self._term_index[match.group(0).lower()]
+            placeholder = f"__TERM{idx}__"
+            term_map[placeholder] = self.terminology[self._sorted_terms[idx]]
+            return placeholder
+
+        return self._term_regex.sub(replace_term, text), term_map
     
     def restore_terminology(self, text, term_map):
         restored_text = text
@@ -69,139 +307,389 @@ class PDFTranslator:
             restored_text = restored_text.replace(placeholder, translation)
         return restored_text
     
-    def translate_text(self, text):
-        if not text.strip():
-            return text
-        
+    def _cache_key(self, text):
+        # Нормализуем пробелы, чтобы "foo  bar\n" и "foo bar" делили один слот.
+        # В ключе лежит 16-байтовый дайджест, а не копия текста: блок на
+        # несколько килобайт не раздувает кэш и не хэшируется целиком
+        # при каждом обращении к словарю
+        normalized = " ".join(text.split())
+        digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+        return (self.source_lang, self.target_lang, self._term_key, digest)
+
+    def _translate_remote(self, text):
+        """Сетевой перевод с повторными попытками, без обращения к кэшу.
+
+        Возвращает None при неудаче — вызывающий сам решает, чем ответить,
+        и неудача не попадает в кэш.
+        """
         try:
             protected_text, term_map = self.protect_terminology(text)
-            
+
             # Пытаемся перевести с повторными попытками
             max_retries = 3
             for attempt in range(max_retries):
                 try:
                     translated = self.translator.translate(protected_text)
                     if translated:
-                        final_text = self.restore_terminology(translated, term_map)
-                        return final_text
+                        return self.restore_terminology(translated, term_map)
                 except Exception as retry_error:
                     print(f"Попытка {attempt + 1}/{max_retries} перевода не удалась: {retry_error}")
                     if attempt < max_retries - 1:
-                        import time
-                        time.sleep(1)  # Пауза перед повторной попыткой
+                        # Экспоненциальная пауза: 0.5с, затем 1с — быстрый
+                        # повтор после случайного сбоя, растущий при рейт-лимите
+                        time.sleep(0.5 * (2 ** attempt))
                     else:
                         raise
-            
-            return text
+
+            return None
         except Exception as e:
             print(f"Ошибка перевода: {e}")
+            return None
+
+    def translate_text(self, text):
+        if not text.strip():
+            return text
+
+        # Безбуквенный текст (числа, «42», «3.14», «---») не гоняем по сети
+        if not _HAS_LETTER_RE.search(text):
             return text
+
+        cache_key = self._cache_key(text)
+        cached = _cache_lookup(cache_key)
+        if cached is not None:
+            return cached
+
+        final_text = self._translate_remote(text)
+        if final_text is None:
+            return text
+
+        _l1_store(cache_key, final_text)
+        _cache_db_put(cache_key, final_text)
+        return final_text
     
-    def extract_images(self, pdf_document, output_folder):
-        Path(output_folder).mkdir(parents=True, exist_ok=True)
-        image_counter = 0
-        
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            image_list = page.get_images()
-            
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                try:
+    @staticmethod
+    def _write_image_file(image_path, image_bytes):
+        try:
+            with open(image_path, "wb") as img_file:
+                img_file.write(image_bytes)
+        except Exception as e:
+            print(f"Ошибка записи изображения {image_path}: {e}")
+
+    def _extract_page_images(self, pdf_document, page_num, output_folder, start_id,
+                             write_pool=None, zipf=None):
+        """Извлечение изображений одной страницы (с кэшированием)"""
+        cached = self._image_cache.get(page_num)
+        if cached is not None:
+            return cached
+
+        page_images = []
+        page = pdf_document[page_num]
+        image_list = page.get_images()
+        image_counter = start_id
+        # Папка одна на весь вызов — склеиваем префикс один раз вместо
+        # os.path.join на каждое изображение
+        folder_prefix = output_folder + os.sep
+
+        for img in image_list:
+            xref = img[0]
+            try:
+                known = self._xref_files.get(xref)
+                if known is None:
+                    # Декодируем байты только при первой встрече xref и сразу
+                    # отдаём их на диск, не задерживая в памяти (и без base64)
                     base_image = pdf_document.extract_image(xref)
                     image_bytes = base_image["image"]
                     image_ext = base_image["ext"]
-                    
-                    # Получаем позицию изображения на странице
-                    try:
-                        img_rect = page.get_image_bbox(img)
-                    except:
-                        # Если не удалось получить bbox, используем дефолтные значения
-                        img_rect = fitz.Rect(0, 0, 100, 100)
-                    
+
                     image_filename = f"image_{image_counter:04d}.{image_ext}"
-                    image_path = os.path.join(output_folder, image_filename)
-                    
-                    with open(image_path, "wb") as img_file:
-                        img_file.write(image_bytes)
-                    
-                    image_base64 = base64.b64encode(image_bytes).decode()
-                    
-                    self.images_data.append({
-                        'id': image_counter,
-                        'filename': image_filename,
-                        'page': page_num,
-                        'position': img_rect,
-                        'ext': image_ext,
-                        'base64': image_base64
-                    })
-                    
-                    image_counter += 1
-                except Exception as e:
-                    print(f"Ошибка извлечения изображения: {e}")
-        
+                    image_path = folder_prefix + image_filename
+
+                    if write_pool is not None:
+                        write_pool.submit(self._write_image_file, image_path, image_bytes)
+                    else:
+                        self._write_image_file(image_path, image_bytes)
+
+                    # Байты уже в руках — кладём их в архив сразу, не перечитывая
+                    # файл с диска на этапе упаковки (ZipFile не потокобезопасен,
+                    # поэтому пишем здесь, а не в пуле)
+                    if zipf is not None:
+                        # Изображения уже сжаты своим кодеком — deflate только
+                        # жжёт CPU, кладём как есть
+                        zipf.writestr(f"images/{image_filename}", image_bytes,
+                                      compress_type=zipfile.ZIP_STORED)
+
+                    known = (image_filename, image_ext, image_path)
+                    self._xref_files[xref] = known
+
+                image_filename, image_ext, image_path = known
+
+                # Получаем позицию изображения на странице; храним простой кортеж,
+                # чтобы не держать объекты MuPDF дольше, чем нужно
+                try:
+                    img_rect = tuple(page.get_image_bbox(img))
+                except:
+                    # Если не удалось получить bbox, используем дефолтные значения
+                    img_rect = (0, 0, 100, 100)
+
+                page_images.append({
+                    'id': image_counter,
+                    'filename': image_filename,
+                    'page': page_num,
+                    'position': img_rect,
+                    'ext': image_ext,
+                    'path': image_path
+                })
+
+                image_counter += 1
+            except Exception as e:
+                print(f"Ошибка извлечения изображения: {e}")
+
+        self._image_cache[page_num] = page_images
+        return page_images
+
+    def extract_images(self, pdf_document, output_folder, zipf=None):
+        Path(output_folder).mkdir(parents=True, exist_ok=True)
+
+        # Разбор страниц должен оставаться последовательным (fitz.Document не
+        # потокобезопасен), но запись файлов на диск — чистый I/O, выносим её в пул
+        self.images_data = []
+        with ThreadPoolExecutor(max_workers=4) as write_pool:
+            for page_num in range(len(pdf_document)):
+                self.images_data.extend(
+                    self._extract_page_images(pdf_document, page_num, output_folder,
+                                              len(self.images_data), write_pool, zipf)
+                )
+                if page_num % 20 == 19:
+                    # Не даём внутреннему кэшу MuPDF расти без ограничений
+                    fitz.TOOLS.store_shrink(100)
+
         return self.images_data
-    
+
+    def _extract_page_text(self, pdf_document, page_num):
+        """Извлечение текстовых блоков одной страницы (с кэшированием)"""
+        cached = self._text_cache.get(page_num)
+        if cached is not None:
+            return cached
+
+        page_blocks = []
+        page = pdf_document[page_num]
+        # "blocks" — самый дешёвый текстовый API PyMuPDF: готовые кортежи
+        # (x0, y0, x1, y1, text, block_no, block_type) без дерева span'ов,
+        # которое здесь всё равно не использовалось (размер шрифта в HTML
+        # не попадает — версткой управляет браузер)
+        blocks = page.get_text(
+            "blocks",
+            flags=fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_PRESERVE_LIGATURES,
+        )
+
+        for x0, y0, x1, y1, block_text, _block_no, block_type in blocks:
+            if block_type != 0:
+                continue
+
+            # isspace() — проверка без аллокации; strip() делаем один раз
+            if block_text and not block_text.isspace():
+                stripped = block_text.strip()
+                # Номера страниц и односимвольные артефакты не стоят
+                # ни перевода, ни места в HTML
+                if self.skip_trivial_blocks and (len(stripped) < 3 or stripped.isdigit()):
+                    continue
+                page_blocks.append({
+                    'type': 'text',
+                    'page': page_num,
+                    'bbox': (x0, y0, x1, y1),
+                    'original': stripped,
+                    'translated': None
+                })
+
+        self._text_cache[page_num] = page_blocks
+        return page_blocks
+
     def extract_text_blocks(self, pdf_document):
+        self.content_blocks = []
         for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            blocks = page.get_text("dict")["blocks"]
-            
-            for block in blocks:
-                if block['type'] == 0:
-                    block_text = ""
-                    font_size = 12
-                    
-                    for line in block.get("lines", []):
-                        for span in line.get("spans", []):
-                            block_text += span["text"]
-                            font_size = span["size"]
-                        block_text += "\n"
-                    
-                    if block_text.strip():
-                        self.content_blocks.append({
-                            'type': 'text',
-                            'page': page_num,
-                            'bbox': block['bbox'],
-                            'original': block_text.strip(),
-                            'translated': None,
-                            'font_size': font_size
-                        })
-        
+            self.content_blocks.extend(self._extract_page_text(pdf_document, page_num))
+            if page_num % 20 == 19:
+                # Не даём внутреннему кэшу MuPDF расти без ограничений
+                fitz.TOOLS.store_shrink(100)
+
         return self.content_blocks
+
+    def extract_content(self, pdf_document, images_folder, zipf=None):
+        """Извлекает изображения и текст за один проход по страницам.
+
+        Каждая страница разбирается PyMuPDF единожды — вдвое дешевле, чем
+        отдельные проходы extract_images + extract_text_blocks.
+        """
+        Path(images_folder).mkdir(parents=True, exist_ok=True)
+
+        self.images_data = []
+        self.content_blocks = []
+        with ThreadPoolExecutor(max_workers=4) as write_pool:
+            for page_num in range(len(pdf_document)):
+                self.images_data.extend(
+                    self._extract_page_images(pdf_document, page_num, images_folder,
+                                              len(self.images_data), write_pool, zipf)
+                )
+                self.content_blocks.extend(self._extract_page_text(pdf_document, page_num))
+                if page_num % 20 == 19:
+                    # Не даём внутреннему кэшу MuPDF расти без ограничений
+                    fitz.TOOLS.store_shrink(100)
+
+        return self.content_blocks, self.images_data
     
+    def get_statistics(self):
+        """Статистика по уже извлечённому содержимому (без повторного разбора PDF)"""
+        total_chars = 0
+        total_words = 0
+        for block in self.content_blocks:
+            text = block['original']
+            total_chars += len(text)
+            total_words += len(text.split())
+
+        return {
+            'text_blocks': len(self.content_blocks),
+            'images': len(self.images_data),
+            'total_chars': total_chars,
+            'total_words': total_words
+        }
+
+    def _make_batches(self, texts):
+        """Жадно упаковывает тексты в пакеты в пределах лимита переводчика"""
+        batches = []
+        current = []
+        current_len = 0
+        sep_len = len(_BATCH_SEPARATOR)
+
+        for text in texts:
+            text_len = len(text) + sep_len
+            if current and current_len + text_len > self._batch_char_limit:
+                batches.append(current)
+                current = []
+                current_len = 0
+            current.append(text)
+            current_len += text_len
+
+        if current:
+            batches.append(current)
+        return batches
+
+    def _translate_batch(self, texts):
+        """Переводит список текстов одним запросом, склеивая их разделителем.
+
+        Если переводчик повредил разделители и количество частей не сошлось,
+        откатываемся на поштучный перевод этого пакета.
+        """
+        if len(texts) == 1:
+            return [self.translate_text(texts[0])]
+
+        # Склейку переводим мимо кэша: блоб с разделителями — одноразовый
+        # артефакт, в кэше должны жить переиспользуемые пары текст → перевод
+        joined = _BATCH_SEPARATOR.join(texts)
+        translated = self._translate_remote(joined)
+        if translated is not None:
+            parts = [part.strip() for part in _BATCH_SEPARATOR_RE.split(translated)]
+            # Строгая проверка: и число частей должно сойтись, и ни одна часть
+            # не должна оказаться пустой — иначе переводчик съел сегмент
+            # и раскладка по блокам поедет молча
+            if len(parts) == len(texts) and all(parts):
+                for text, part in zip(texts, parts):
+                    pair_key = self._cache_key(text)
+                    _l1_store(pair_key, part)
+                    _cache_db_put(pair_key, part)
+                return parts
+
+            print(f"Пакетный перевод не разобрался ({len(parts)} частей вместо {len(texts)}), "
+                  f"переводим поштучно")
+        return [self.translate_text(text) for text in texts]
+
     def translate_blocks(self, progress_callback=None):
+        # content_blocks содержит только текстовые блоки — проверка типа не нужна.
+        # Блоки переводятся пакетами: один сетевой запрос на несколько блоков,
+        # пакеты уходят параллельно — перевод почти целиком ждёт сеть
         total = len(self.content_blocks)
-        for idx, block in enumerate(self.content_blocks):
-            if block['type'] == 'text':
-                block['translated'] = self.translate_text(block['original'])
-                if progress_callback:
-                    progress_callback(idx + 1, total)
+        if not total:
+            return
+
+        # Одинаковые блоки (колонтитулы, повторяющиеся подписи) переводятся
+        # один раз — результат раскладывается по всем вхождениям
+        groups = defaultdict(list)
+        for block in self.content_blocks:
+            groups[block['original']].append(block)
+
+        # Пре-проход по кэшу: уже переведённые строки заполняются сразу,
+        # в пакеты попадают только промахи. Повторная обработка того же
+        # документа не создаёт ни одного сетевого запроса
+        misses = []
+        done = 0
+        for text, text_blocks in groups.items():
+            if not _HAS_LETTER_RE.search(text):
+                cached = text
+            else:
+                cached = _cache_lookup(self._cache_key(text))
+            if cached is not None:
+                for block in text_blocks:
+                    block['translated'] = cached
+                done += len(text_blocks)
+            else:
+                misses.append(text)
+
+        if progress_callback and done:
+            progress_callback(done, total)
+        if not misses:
+            return
+
+        batches = self._make_batches(misses)
+        done_lock = threading.Lock()
+
+        def translate_one_batch(batch_texts):
+            nonlocal done
+            translations = self._translate_batch(batch_texts)
+            finished_blocks = 0
+            for text, translated in zip(batch_texts, translations):
+                for block in groups[text]:
+                    block['translated'] = translated
+                finished_blocks += len(groups[text])
+            with done_lock:
+                done += finished_blocks
+                finished = done
+            if progress_callback:
+                progress_callback(finished, total)
+
+        if len(batches) == 1:
+            translate_one_batch(batches[0])
+        else:
+            with ThreadPoolExecutor(max_workers=min(8, len(batches))) as pool:
+                # list() дожидается всех пакетов и пробрасывает исключения
+                list(pool.map(translate_one_batch, batches))
     
     def merge_content(self):
+        # Постраничный индекс уже построен при извлечении (_text_cache /
+        # _image_cache) — используем его напрямую, без повторного прохода
+        # по плоским спискам; сортируем только внутри страницы.
+        # Элементы — лёгкие кортежи (page, y, kind, ref), а не словари-обёртки
         merged = []
-        
-        for block in self.content_blocks:
-            merged.append({
-                'type': 'text',
-                'page': block['page'],
-                'y_position': block['bbox'][1],
-                'content': block
-            })
-        
-        for img in self.images_data:
-            merged.append({
-                'type': 'image',
-                'page': img['page'],
-                'y_position': img['position'][1] if img['position'] else 0,
-                'content': img
-            })
-        
-        merged.sort(key=lambda x: (x['page'], x['y_position']))
+        for page_num in sorted(self._text_cache.keys() | self._image_cache.keys()):
+            page_items = [
+                (page_num, block['bbox'][1], 'text', block)
+                for block in self._text_cache.get(page_num, ())
+            ]
+
+            page_items.extend(
+                (page_num, img['position'][1] if img['position'] else 0, 'image', img)
+                for img in self._image_cache.get(page_num, ())
+            )
+
+            # itemgetter — C-реализация ключа вместо вызова лямбды на элемент
+            page_items.sort(key=itemgetter(1))
+            merged.extend(page_items)
+
         return merged
     
     def generate_html(self, merged_content, output_path, original_filename):
-        html = f"""<!DOCTYPE html>
+        # Пишем документ в файл по мере генерации: ни одной гигантской строки
+        # со всеми блоками и base64-изображениями в памяти не собирается
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(f"""<!DOCTYPE html>
 <html lang="{self.target_lang}">
 <head>
     <meta charset="UTF-8">
@@ -303,124 +791,118 @@ class PDFTranslator:
             <div class="meta">
                 Исходный файл: {original_filename}<br>
                 Направление перевода: {self.source_lang.upper()} → {self.target_lang.upper()}<br>
-                Текстовых блоков: {len([x for x in merged_content if x['type'] == 'text'])}<br>
-                Изображений: {len([x for x in merged_content if x['type'] == 'image'])}
+                Текстовых блоков: {len(self.content_blocks)}<br>
+                Изображений: {len(self.images_data)}
             </div>
         </div>
-"""
-        
-        if self.terminology:
-            html += f"""
+""")
+
+            if self.terminology:
+                f.write(f"""
         <div class="terminology-info">
             <h3>📚 Используемая терминология</h3>
             Документ переведен с учетом специализированного словаря терминов.<br>
             <small>Количество терминов: {len(self.terminology)}</small>
         </div>
-"""
-        
-        current_page = -1
-        block_id = 0
-        
-        for item in merged_content:
-            if item['page'] != current_page:
-                if current_page != -1:
-                    html += '<div class="page-break"></div>\n'
-                current_page = item['page']
-                html += f'<div class="page-number">Страница {current_page + 1}</div>\n'
-            
-            if item['type'] == 'text':
-                content = item['content']
-                html += f"""
-        <div class="translation-toggle">
-            <button class="toggle-btn" id="btn-{block_id}" onclick="toggleOriginal({block_id})">Показать оригинал</button>
-            <div class="text-block">
-                {content['translated'].replace(chr(10), '<br>')}
-            </div>
-            <div class="original-text" id="original-{block_id}">
-                <strong>Оригинал:</strong><br>
-                {content['original'].replace(chr(10), '<br>')}
-            </div>
-        </div>
-"""
-                block_id += 1
-            
-            elif item['type'] == 'image':
-                img = item['content']
-                html += f"""
-        <div class="image-container">
-            <img src="data:image/{img['ext']};base64,{img['base64']}" 
-                 alt="Изображение со страницы {img['page'] + 1}">
-            <div class="image-caption">Рисунок {img['id'] + 1} (Страница {img['page'] + 1})</div>
-        </div>
-"""
-        
-        html += """
+""")
+
+            current_page = -1
+            block_id = 0
+
+            for page_num, _y, kind, content in merged_content:
+                if page_num != current_page:
+                    if current_page != -1:
+                        f.write('<div class="page-break"></div>\n')
+                    current_page = page_num
+                    f.write(f'<div class="page-number">Страница {current_page + 1}</div>\n')
+
+                if kind == 'text':
+                    f.write(_TEXT_BLOCK_TPL % (
+                        block_id, block_id,
+                        content['translated'].translate(_HTML_ESCAPE_TABLE),
+                        block_id,
+                        content['original'].translate(_HTML_ESCAPE_TABLE),
+                    ))
+                    block_id += 1
+
+                elif kind == 'image':
+                    img = content
+                    # Ссылка на файл рядом с HTML (в архиве и в папке задачи) —
+                    # без base64-раздувания документа
+                    f.write(_IMAGE_BLOCK_TPL % (
+                        img['filename'],
+                        img['page'] + 1, img['id'] + 1, img['page'] + 1,
+                    ))
+
+            f.write("""
     </div>
 </body>
-</html>"""
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(html)
+</html>""")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 def process_pdf_task(task_id, pdf_path, terminology, source_lang, target_lang):
     """Фоновая задача обработки PDF"""
+    # один lookup вместо обращения tasks[task_id] на каждое обновление
+    task = tasks[task_id]
     try:
-        tasks[task_id]['status'] = 'processing'
-        tasks[task_id]['progress'] = 0
-        
+        task['status'] = 'processing'
+        task['progress'] = 0
+
         print(f"Создание переводчика: {source_lang} -> {target_lang}")
         print(f"Терминология: {terminology}")
         translator = PDFTranslator(terminology, source_lang, target_lang)
-        pdf_document = fitz.open(pdf_path)
-        
-        tasks[task_id]['total_pages'] = len(pdf_document)
-        
-        # Извлечение изображений
-        tasks[task_id]['stage'] = 'Извлечение изображений'
+
         output_folder = os.path.join(app.config['OUTPUT_FOLDER'], task_id)
         Path(output_folder).mkdir(parents=True, exist_ok=True)
         images_folder = os.path.join(output_folder, "images")
-        translator.extract_images(pdf_document, images_folder)
-        
-        # Извлечение текста
-        tasks[task_id]['stage'] = 'Извлечение текста'
-        translator.extract_text_blocks(pdf_document)
-        
-        # Перевод
-        tasks[task_id]['stage'] = 'Перевод'
-        def progress_callback(current, total):
-            tasks[task_id]['progress'] = int((current / total) * 100)
-        
-        translator.translate_blocks(progress_callback)
-        
-        # Генерация HTML
-        tasks[task_id]['stage'] = 'Генерация HTML'
-        merged_content = translator.merge_content()
-        html_path = os.path.join(output_folder, "translated_document.html")
-        translator.generate_html(merged_content, html_path, os.path.basename(pdf_path))
-        
-        pdf_document.close()
-        
-        # Создание ZIP архива
-        tasks[task_id]['stage'] = 'Создание архива'
         zip_path = os.path.join(output_folder, "result.zip")
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            zipf.write(html_path, "translated_document.html")
-            for img_data in translator.images_data:
-                img_path = os.path.join(images_folder, img_data['filename'])
-                zipf.write(img_path, f"images/{img_data['filename']}")
-        
-        tasks[task_id]['status'] = 'completed'
-        tasks[task_id]['result_path'] = zip_path
-        tasks[task_id]['html_path'] = html_path
-        tasks[task_id]['progress'] = 100
-        
+        html_path = os.path.join(output_folder, "translated_document.html")
+
+        # Документ как контекстный менеджер: закрывается и при исключении,
+        # а не только на успешном пути
+        with fitz.open(pdf_path) as pdf_document:
+            task['total_pages'] = len(pdf_document)
+
+            # Архив открыт на всё время обработки: изображения попадают в него
+            # прямо при извлечении, без повторного чтения с диска
+            with zipfile.ZipFile(zip_path, 'w') as zipf:
+                # Извлечение текста и изображений одним проходом по страницам
+                task['stage'] = 'Извлечение содержимого'
+                translator.extract_content(pdf_document, images_folder, zipf=zipf)
+                task['statistics'] = translator.get_statistics()
+
+                # Перевод: документ дальше не нужен, но закрытие произойдёт
+                # само по выходе из with
+                task['stage'] = 'Перевод'
+                def progress_callback(current, total):
+                    # целочисленная арифметика вместо float-деления на каждый блок
+                    task['progress'] = current * 100 // total
+
+                translator.translate_blocks(progress_callback)
+
+                # Генерация HTML
+                task['stage'] = 'Генерация HTML'
+                merged_content = translator.merge_content()
+                translator.generate_html(merged_content, html_path, os.path.basename(pdf_path))
+
+                # Завершение архива: текст жмётся deflate'ом в разы,
+                # в отличие от изображений выше
+                task['stage'] = 'Создание архива'
+                zipf.write(html_path, "translated_document.html",
+                           compress_type=zipfile.ZIP_DEFLATED, compresslevel=6)
+
+        with _tasks_lock:
+            task['status'] = 'completed'
+            task['result_path'] = zip_path
+            task['html_path'] = html_path
+            task['progress'] = 100
+
     except Exception as e:
-        tasks[task_id]['status'] = 'error'
-        tasks[task_id]['error'] = str(e)
+        with _tasks_lock:
+            task['status'] = 'error'
+            task['error'] = str(e)
 
 # HTML шаблон для веб-интерфейса
 HTML_TEMPLATE = """
@@ -789,11 +1271,16 @@ def upload():
     filename = secure_filename(file.filename)
     task_id = str(uuid.uuid4())
     upload_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_{filename}")
-    file.save(upload_path)
+    # werkzeug пишет загрузку на диск потоково; буфер 64 КБ вместо
+    # дефолтных 16 КБ — меньше системных вызовов на больших PDF
+    file.save(upload_path, buffer_size=64 * 1024)
     
-    # Получаем параметры
-    source_lang = request.form.get('source_lang', 'en')
-    target_lang = request.form.get('target_lang', 'ru')
+    # Получаем параметры; отклоняем неизвестный язык до того, как начнётся
+    # дорогая обработка PDF
+    source_lang = get_language_code(request.form.get('source_lang', 'en'))
+    target_lang = get_language_code(request.form.get('target_lang', 'ru'))
+    if source_lang not in _CODE_SET or target_lang not in _CODE_SET:
+        return jsonify({'success': False, 'error': 'Неподдерживаемый язык перевода'})
     
     # Парсим терминологию
     terminology = {}
@@ -812,30 +1299,48 @@ def upload():
         'filename': filename
     }
     
-    # Запускаем обработку в фоновом потоке
-    thread = threading.Thread(
-        target=process_pdf_task,
-        args=(task_id, upload_path, terminology, source_lang, target_lang)
-    )
-    thread.daemon = True
-    thread.start()
-    
+    # Запускаем обработку в общем пуле
+    _task_executor.submit(process_pdf_task, task_id, upload_path,
+                          terminology, source_lang, target_lang)
+
     return jsonify({'success': True, 'task_id': task_id})
 
+def _conditional_task_json(snapshot):
+    """Ответ со статусом задачи с поддержкой ETag/304.
+
+    Фронтенд опрашивает статус каждую секунду; пока задача не продвинулась,
+    повторный опрос получает пустой 304 вместо полного JSON.
+    """
+    # В заголовок попадает только дайджест: stage — кириллица, а значения
+    # HTTP-заголовков обязаны кодироваться в latin-1
+    state = f"{snapshot.get('status')}-{snapshot.get('progress')}-{snapshot.get('stage')}"
+    etag = hashlib.md5(state.encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(snapshot)
+    response.set_etag(etag)
+    # no-cache = «кэшируй, но перепроверяй» — заставляет браузер слать If-None-Match
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/progress/<task_id>')
 def progress(task_id):
-    if task_id not in tasks:
+    task = tasks.get(task_id)
+    if task is None:
         return jsonify({'status': 'not_found', 'error': 'Задача не найдена'})
-    
-    return jsonify(tasks[task_id])
+
+    # Снимок под блокировкой, чтобы не отдать наполовину обновлённую задачу
+    with _tasks_lock:
+        snapshot = dict(task)
+    return _conditional_task_json(snapshot)
 
 @app.route('/download/<task_id>')
 def download(task_id):
-    if task_id not in tasks:
+    task = tasks.get(task_id)
+    if task is None:
         return "Задача не найдена", 404
-    
-    task = tasks[task_id]
-    
+
     if task['status'] != 'completed':
         return "Задача еще не завершена", 400
     
@@ -846,21 +1351,31 @@ def download(task_id):
         mimetype='application/zip'
     )
 
-@app.route('/view/<task_id>')
+@app.route('/view/<task_id>/')
 def view(task_id):
-    if task_id not in tasks:
+    # Завершающий слэш нужен, чтобы относительные пути images/... из HTML
+    # разрешались в /view/<task_id>/images/...; Flask сам редиректит без слэша
+    task = tasks.get(task_id)
+    if task is None:
         return "Задача не найдена", 404
-    
-    task = tasks[task_id]
-    
+
     if task['status'] != 'completed':
         return "Задача еще не завершена", 400
-    
+
     with open(task['html_path'], 'r', encoding='utf-8') as f:
         html_content = f.read()
-    
+
     return html_content
 
+@app.route('/view/<task_id>/images/<filename>')
+def view_image(task_id, filename):
+    task = tasks.get(task_id)
+    if task is None:
+        return "Задача не найдена", 404
+
+    images_folder = os.path.join(app.config['OUTPUT_FOLDER'], task_id, "images")
+    return send_from_directory(images_folder, filename)
+
 @app.route('/api/translate', methods=['POST'])
 def api_translate():
     """API endpoint для программного доступа"""
@@ -875,11 +1390,15 @@ def api_translate():
     filename = secure_filename(file.filename)
     task_id = str(uuid.uuid4())
     upload_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_{filename}")
-    file.save(upload_path)
-    
-    source_lang = request.form.get('source_lang', 'en')
-    target_lang = request.form.get('target_lang', 'ru')
+    # werkzeug пишет загрузку на диск потоково; буфер 64 КБ вместо
+    # дефолтных 16 КБ — меньше системных вызовов на больших PDF
+    file.save(upload_path, buffer_size=64 * 1024)
     
+    source_lang = get_language_code(request.form.get('source_lang', 'en'))
+    target_lang = get_language_code(request.form.get('target_lang', 'ru'))
+    if source_lang not in _CODE_SET or target_lang not in _CODE_SET:
+        return jsonify({'error': 'Unsupported language'}), 400
+
     terminology = {}
     if 'terminology' in request.files:
         term_file = request.files['terminology']
@@ -897,13 +1416,9 @@ def api_translate():
         'filename': filename
     }
     
-    thread = threading.Thread(
-        target=process_pdf_task,
-        args=(task_id, upload_path, terminology, source_lang, target_lang)
-    )
-    thread.daemon = True
-    thread.start()
-    
+    _task_executor.submit(process_pdf_task, task_id, upload_path,
+                          terminology, source_lang, target_lang)
+
     return jsonify({
         'success': True,
         'task_id': task_id,
@@ -914,21 +1429,32 @@ def api_translate():
 @app.route('/api/status/<task_id>')
 def api_status(task_id):
     """API endpoint для проверки статуса"""
-    if task_id not in tasks:
+    task = tasks.get(task_id)
+    if task is None:
         return jsonify({'error': 'Task not found'}), 404
-    
-    return jsonify(tasks[task_id])
+
+    with _tasks_lock:
+        snapshot = dict(task)
+    return _conditional_task_json(snapshot)
 
 if __name__ == '__main__':
-    print("\n" + "="*70)
-    print(" "*20 + "PDF ПЕРЕВОДЧИК - СЕРВЕР")
-    print("="*70)
-    print("\n📡 Сервер запущен!")
-    print(f"🌐 Веб-интерфейс: http://localhost:5000")
-    print(f"🔌 API endpoint: http://localhost:5000/api/translate")
-    print("\n💡 Для доступа из сети используйте:")
-    print("   python server.py --host 0.0.0.0 --port 5000")
-    print("\n" + "="*70 + "\n")
+    # Один буферизованный вывод вместо десятка отдельных print
+    print("\n".join([
+        "",
+        "=" * 70,
+        " " * 20 + "PDF ПЕРЕВОДЧИК - СЕРВЕР",
+        "=" * 70,
+        "",
+        "📡 Сервер запущен!",
+        "🌐 Веб-интерфейс: http://localhost:5000",
+        "🔌 API endpoint: http://localhost:5000/api/translate",
+        "",
+        "💡 Для доступа из сети используйте:",
+        "   python server.py --host 0.0.0.0 --port 5000",
+        "",
+        "=" * 70,
+        "",
+    ]))
     
     import sys
     host = '127.0.0.1'
@@ -938,5 +1464,7 @@ if __name__ == '__main__':
         host = sys.argv[sys.argv.index('--host') + 1]
     if '--port' in sys.argv:
         port = int(sys.argv[sys.argv.index('--port') + 1])
-    
-    app.run(host=host, port=port, debug=True, threaded=True)
\ No newline at end of file
+
+    # Режим отладки включается явно: debug=True держит перезагрузчик
+    # и раздувает трассировки на каждый запрос
+    app.run(host=host, port=port, debug='--debug' in sys.argv, threaded=True)
\ No newline at end of file